@@ -12,10 +12,13 @@ from adafruit_ble.advertising.standard import Advertisement
 from adafruit_ble.services.standard.device_info import DeviceInfoService
 from adafruit_ble_berrymed_pulse_oximeter import BerryMedPulseOximeterService
 
-import os
+import csv
+import numpy as np
 import pandas as pd
 import time
+from collections import deque
 from datetime import datetime
+from pathlib import Path
 import threading
 
 class PulseOximeterBLE:
@@ -29,38 +32,122 @@ class PulseOximeterBLE:
     if hasattr(_bleio, 'ConnectionError'):
         connection_error = _bleio.ConnectionError
 
+    # Muestras válidas esperadas por segundo (BerryMed: ~50 Hz brutas, ~1 válida/s)
+    EXPECTED_HZ = 1
+
+    # Espera entre sondeos sin datos. Las notificaciones BLE se acumulan en el
+    # buffer del servicio; dormir muy por debajo del periodo de paquete
+    # (~20 ms) evita quemar CPU sin perder muestras.
+    POLL_IDLE_S = 0.005
+
+    # Registro completo empaquetado: 5 bytes/muestra frente a ~200 de una
+    # lista de Python con 5 referencias
+    FULL_RECORD_DTYPE = np.dtype([('valid', 'u1'), ('spo2', 'u1'), ('bpm', 'u1'),
+                                  ('pleth', 'u1'), ('finger', 'u1')])
+
     def __init__(self, verbose=True):
         self.verbose = verbose
         self.connection = None
         self.thread = None
+        self._stop = threading.Event()
+        self._df_cache = None
+        self._alloc_buffers(1024)
+
+    # Reservar los buffers de captura con una capacidad inicial dada.
+    # Arrays tipados (uint8 basta: BPM < 255 es precondición de la medición
+    # válida); crecen por duplicación en _grow_buffers y las series exponen
+    # la porción lógica [0:_n] sin copiar.
+    def _alloc_buffers(self, capacity):
+        self._buf_size = capacity
+        self._n = 0
+        self._bpm   = np.empty(capacity, np.uint8)
+        self._spo2  = np.empty(capacity, np.uint8)
+        self._pleth = np.empty(capacity, np.uint8)
+        self._t     = np.empty(capacity, np.float64)
+        self._full  = np.empty(capacity, self.FULL_RECORD_DTYPE)
 
     @property
     def connected(self):
         return self.connection and self.connection.connected
 
+    # Series temporales: vistas sobre los buffers de captura, accesibles
+    # también en mitad de una lectura (p.ej. para plot en vivo)
+    @property
+    def BPM_series(self):
+        return pd.Series(self._bpm[:self._n], index=self._t[:self._n], copy=False)
+
+    @property
+    def SpO2_series(self):
+        return pd.Series(self._spo2[:self._n], index=self._t[:self._n], copy=False)
+
+    @property
+    def Pleth_series(self):
+        return pd.Series(self._pleth[:self._n], index=self._t[:self._n], copy=False)
+
     @property
     def dataframe(self):
         """Recoger los datos obtenidos en pd.Series a un DataFrame"""
-        df = pd.DataFrame()
-        df['BPM']  = self.BPM_series   if hasattr(self, "BPM_series")   else None
-        df['SpO2'] = self.SpO2_series  if hasattr(self, "SpO2_series")  else None
-        df['Pleth']= self.Pleth_series if hasattr(self, "Pleth_series") else None
-        return df
+        # Memoizado: update_record lo marca sucio al llegar nuevas muestras
+        if self._df_cache is None:
+            # Construcción en una sola pasada: asignar columna a columna sobre un
+            # DataFrame vacío fragmenta los bloques internos (PerformanceWarning)
+            self._df_cache = pd.DataFrame({
+                'BPM':   self.BPM_series,
+                'SpO2':  self.SpO2_series,
+                'Pleth': self.Pleth_series,
+            })
+        return self._df_cache
 
     # Actualizar registro de las series temporales
     # - data: lista o tupla. Contiene, en orden, BPM, SpO2, pleth
     # - t: int/float. Indica el valor temporal de los datos
+    # Se escriben los valores por índice en los buffers preasignados
+    # (O(1) amortizado); las series exponen la porción escrita como vista.
     def update_record(self, data, t):
         BPM, SpO2, pleth = data
-        self.BPM_series  = self.BPM_series.append(  pd.Series(BPM,  index=[t]) )
-        self.SpO2_series = self.SpO2_series.append( pd.Series(SpO2, index=[t]) )
-        self.Pleth_series= self.Pleth_series.append(pd.Series(pleth,index=[t]) )
+        n = self._n
+        if n >= self._buf_size:
+            self._grow_buffers()
+        self._bpm[n]   = BPM
+        self._spo2[n]  = SpO2
+        self._pleth[n] = pleth
+        self._t[n]     = t
+        self._n = n + 1
+        self._df_cache = None
+
+    # Imprimir los mensajes encolados por el bucle de lectura.
+    # Se ejecuta en un hilo aparte para que la escritura en stdout no añada
+    # latencia ni jitter al muestreo BLE.
+    def _drain_logs(self, log_buf):
+        while True:
+            try:
+                msg = log_buf.popleft()
+            except IndexError:
+                time.sleep(0.05)
+                continue
+            if msg is None: # Centinela de fin de lectura
+                break
+            print(msg)
+
+    # Duplicar la capacidad de los buffers (crecimiento geométrico)
+    def _grow_buffers(self):
+        extra = self._buf_size
+        self._bpm   = np.concatenate((self._bpm,   np.empty(extra, np.uint8)))
+        self._spo2  = np.concatenate((self._spo2,  np.empty(extra, np.uint8)))
+        self._pleth = np.concatenate((self._pleth, np.empty(extra, np.uint8)))
+        self._t     = np.concatenate((self._t,     np.empty(extra, np.float64)))
+        self._full  = np.concatenate((self._full,  np.empty(extra, self.FULL_RECORD_DTYPE)))
+        self._buf_size += extra
 
     # --- ESTABLECER LA CONEXIÓN --- #
-    def connect_pulse_oximeter(self, target="BerryMed", timeout=15):
+    def connect_pulse_oximeter(self, target="BerryMed", timeout=15, filter_scan=True):
         """
         1- Buscar dispositivos Bluetooth disponibles.
         2- Establecer conexión con el cual tenga de nombre 'target'
+        - filter_scan: filtrar los anuncios en el propio stack BLE por el
+          'Complete Local Name' del objetivo, de modo que los paquetes de
+          otros dispositivos se descartan antes de llegar a Python. Usar
+          False para listar todos los dispositivos cercanos (con verbose).
         """
 
         self.ble_radio = adafruit_ble.BLERadio()
@@ -68,11 +155,33 @@ class PulseOximeterBLE:
 
         found_devices = set()
 
+        # Objetivo canónico, calculado una sola vez
+        target = target.strip('\x00')
+        target_len = len(target)
+
+        # 0x09 = AD type 'Complete Local Name'
+        scan_type = Advertisement
+        if filter_scan:
+            class _TargetAdvertisement(Advertisement):
+                match_prefixes = (b"\x09" + target.encode(),)
+            scan_type = _TargetAdvertisement
+
         print(f"Buscando dispositivos Bluetooth...\n- Objetivo: '{target}'")
-        for advert in self.ble_radio.start_scan(Advertisement, timeout=timeout):
+        for advert in self.ble_radio.start_scan(scan_type, timeout=timeout):
             name = advert.complete_name
             if not name: continue
 
+            # Prefiltro por longitud: descarta la mayoría de paquetes sin
+            # pagar el strip+comparación (los escaneos densos llegan a
+            # cientos de anuncios por segundo)
+            if len(name) - name.count('\x00') != target_len:
+                if self.verbose:
+                    name = name.strip('\x00')
+                    if name not in found_devices:
+                        print(f"Encontrado '{name}'.")
+                        found_devices.add(name)
+                continue
+
             name = name.strip('\x00') # Posibles nulls en el nombre
 
             # Dispositivo encontrado
@@ -126,65 +235,130 @@ class PulseOximeterBLE:
         else:
             print("Sin información del dispositivo.\n")
 
-    def receive_data(self, duration=None):
-        """Recoger los datos tomados por el pulsioximetro"""
+    def receive_data(self, duration=None, stream_path=None):
+        """
+        Recoger los datos tomados por el pulsioximetro
+        - stream_path: si se indica, cada muestra válida se vuelca además a
+          ese fichero (tsv) según llega, con flush por fila, de modo que una
+          desconexión o corte pierde como mucho una muestra
+        """
         service = self.connection[BerryMedPulseOximeterService]
 
-        # Series temporales
-        self.BPM_series   = pd.Series()
-        self.SpO2_series  = pd.Series()
-        self.Pleth_series = pd.Series()
-        full_record= list()
+        # Invalidar el DataFrame memoizado de la captura anterior
+        self._df_cache = None
+
+        # Buffers preasignados según la duración estimada de la captura
+        est = int((duration or 60) * self.EXPECTED_HZ) + 16
+        self._alloc_buffers(est)
 
         if duration: print(f"Duración: {duration} segundos")
         print("--- Lectura comenzada ---\n")
-        
-        # Marcadores temporales
-        timestamps = list()
-        t0 = time.perf_counter()
-
-        # Hilo y Flag de control
-        self.thread = threading.currentThread()
-        self.thread.running = True
 
-        # Lectura
-        while self.connection.connected and self.thread.running:
-            read_data = service.values
+        # Volcado incremental a disco (opcional)
+        stream_file = stream_row = None
+        if stream_path:
+            stream_file = open(stream_path, 'w', newline='')
+            stream_row = csv.writer(stream_file, delimiter='\t').writerow
+            stream_row(['t', 'BPM', 'SpO2', 'Pleth'])
+
+        # Hilo de impresión: saca el print del bucle de lectura
+        log_buf = deque()
+        log_thread = None
+        if self.verbose:
+            log_thread = threading.Thread(target=self._drain_logs, args=(log_buf,))
+            log_thread.start()
+
+        # Flag de parada (stop_read la activa desde otro hilo)
+        self._stop.clear()
+
+        # Ligaduras locales: evita repetir la resolución de atributos
+        # en cada iteración del bucle de lectura
+        perf       = time.perf_counter
+        sleep      = time.sleep
+        idle       = self.POLL_IDLE_S
+        connection = self.connection
+        stopped    = self._stop.is_set
+        verbose    = self.verbose
+        log_append = log_buf.append
 
-            if read_data:
-                [valid, SpO2, BPM, pleth, finger_in] = read_data
-
-                valid_sample = valid and finger_in and BPM < 255
-
-                # Medición válida
-                if valid_sample:
-                    t = time.perf_counter() - t0
-                    t = round(t,2)
-                    timestamps.append(t)
-
-                    if self.verbose: print(f"Pulso: {BPM}, SpO2: {SpO2}, Pleth: {pleth} ({t} seg)")
-
-                    # Almacenar valores adquiridos
-                    self.update_record((BPM, SpO2, pleth), t)
-
-                    full_record.append(read_data)
+        # Marcadores temporales
+        t0 = perf()
 
-            # Limite de tiempo
-            t = time.perf_counter() - t0
-            if duration and t > duration:
-                print(f"\nTiempo límite alcanzado: {round(t,2)} (máx {duration} seg)")
-                break
+        # Lectura. El finally garantiza la limpieza también si el bucle
+        # termina con una excepción (p.ej. connection_error al desconectarse
+        # el dispositivo a mitad de captura).
+        try:
+            while connection.connected and not stopped():
+                # Una sola llamada a perf_counter por iteración; se reutiliza
+                # para la marca temporal y para el límite de tiempo
+                t = perf() - t0
+
+                # Limite de tiempo
+                if duration and t > duration:
+                    print(f"\nTiempo límite alcanzado: {round(t,2)} (máx {duration} seg)")
+                    break
+
+                read_data = service.values
+
+                if read_data is None:
+                    # Sin paquete pendiente: ceder la CPU hasta la próxima notificación
+                    sleep(idle)
+                    continue
+
+                valid, SpO2, BPM, pleth, finger_in = read_data
+
+                # Punto de cesión del GIL: con paquetes llegando en ráfaga
+                # este hilo no dormiría nunca y acapararía el intérprete
+                # frente al hilo principal (UI/plotter) en lecturas threaded
+                sleep(0)
+
+                # Medición válida: '&' entero en lugar del cortocircuito
+                # de 'and', que genera saltos extra en el camino caliente
+                if (valid & finger_in) == 0 or BPM >= 255:
+                    continue
+
+                # Marca temporal sin redondear: el redondeo se hace en una
+                # sola pasada vectorizada al acabar la lectura
+                if verbose: log_append(f"Pulso: {BPM}, SpO2: {SpO2}, Pleth: {pleth} ({t:.2f} seg)")
+
+                # Almacenar valores adquiridos (update_record avanza self._n
+                # y amplía los buffers si hace falta)
+                n = self._n
+                self.update_record((BPM, SpO2, pleth), t)
+                self._full[n] = (valid, SpO2, BPM, pleth, finger_in)
+
+                if stream_row:
+                    stream_row((round(t, 2), BPM, SpO2, pleth))
+                    # Flush por fila: a ~1 muestra válida/s el coste es
+                    # despreciable y la fila queda fuera del buffer de stdio
+                    stream_file.flush()
+
+        finally:
+            # Cerrar el volcado incremental
+            if stream_file:
+                stream_file.close()
+                print(f"\nMuestras volcadas en {stream_path}")
+
+            # Vaciar y detener el hilo de impresión
+            if log_thread:
+                log_buf.append(None)
+                log_thread.join()
 
         print("\n--- Lectura finalizada ---")
 
-        self.full_record = full_record
-        self.timestamps = timestamps
+        # Redondeo vectorizado de las marcas temporales, en una sola pasada;
+        # las series (vistas sobre los buffers) lo exponen directamente
+        n = self._n
+        self._t[:n] = np.round(self._t[:n], 2)
+        self.timestamps = self._t[:n].tolist()
+        self.full_record = self._full[:n]
+        self._df_cache = None
 
         if not self.connection.connected: print("=> Dispositivo desconectado")
 
     ## Método global para la lectura de datos
     # - duration: Tiempo en segundos hasta detener la lectura automáticamente
-    def read(self, duration=None, threaded=False):
+    def read(self, duration=None, threaded=False, stream_path=None):
         """
         1- Lectura de datos del dispositivo
         2- Toma de datos del pulsioximetro
@@ -198,37 +372,51 @@ class PulseOximeterBLE:
             # 2- Extracción de datos continua
             try:
                 if threaded:
-                    self.thread = threading.Thread(target=self.receive_data, args=(duration,))
+                    self.thread = threading.Thread(target=self.receive_data, args=(duration, stream_path))
                     self.thread.start()
                 else:
-                    self.receive_data(duration=duration)
+                    self.receive_data(duration=duration, stream_path=stream_path)
             except self.connection_error:
-                connection = disconnect_pulse_oximeter()
+                self.disconnect_pulse_oximeter()
 
     # Detener lectura de datos
     def stop_read(self):
-        if self.thread:
-            self.thread.running = False
+        self._stop.set()
 
-    def save_csv(self, filename=None, folder='Records/', prefix=None):
-        """Guardar las mediciones en un fichero csv o txt"""
+    # Resolver la ruta de guardado, creando la carpeta si no existe
+    def _output_path(self, filename, folder, prefix, default_ext, valid_exts):
         if filename == None: # Alternativa unívoca
-            filename = datetime.now().strftime('%Y%m%d_%H%M%S') + '.txt'
+            filename = datetime.now().strftime('%Y%m%d_%H%M%S') + default_ext
             if prefix:
                 filename = prefix + '_' + filename
 
-        assert filename[-4:] in ['.csv', '.txt'], f"Fichero debe tener extensión .csv o .txt: {filename}"
-        if folder[-1] not in ['\\', '/']: folder += '/'
+        assert filename.endswith(valid_exts), f"Fichero debe tener extensión {' o '.join(valid_exts)}: {filename}"
 
-        # Crear carpeta si no existe
-        if not os.path.isdir(folder):
-            os.mkdir(folder)
-            print(f"Carpeta {folder} creada.")
+        # Crear carpeta si no existe (sin TOCTOU entre comprobación y creación)
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
 
         # Ruta completa
-        path = folder + filename
-        assert not os.path.isfile(path), f"Ya existe el fichero {path}."
+        path = folder / filename
+        assert not path.exists(), f"Ya existe el fichero {path}."
+        return path
+
+    def save_csv(self, filename=None, folder='Records/', prefix=None):
+        """Guardar las mediciones en un fichero csv o txt"""
+        path = self._output_path(filename, folder, prefix, '.txt', ('.csv', '.txt'))
 
         # Guardado
         self.dataframe.to_csv(path, sep='\t')
+        print(f"Guardado en {path}")
+
+    def save_parquet(self, filename=None, folder='Records/', prefix=None):
+        """
+        Guardar las mediciones en un fichero parquet (binario columnar).
+        Mucho más compacto que el volcado en texto y con lectura vectorizada
+        desde pandas/duckdb. Requiere pyarrow.
+        """
+        path = self._output_path(filename, folder, prefix, '.parquet', ('.parquet',))
+
+        # Guardado
+        self.dataframe.to_parquet(path, engine='pyarrow', compression='zstd')
         print(f"Guardado en {path}")
\ No newline at end of file